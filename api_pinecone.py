@@ -1,12 +1,29 @@
 import os
-from fastapi import FastAPI, Query, HTTPException
+import time
+import asyncio
+import atexit
+import logging
+import logging.handlers
+import queue
+import hashlib
+import random
+from contextlib import asynccontextmanager, nullcontext, suppress
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import FastAPI, Query, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from openai import AsyncOpenAI, APIConnectionError
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional
 import uvicorn
+import httpx
+import orjson
 from pinecone import Pinecone
+from cachetools import TTLCache
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 # Obtém o caminho absoluto do diretório atual
 diretorio_atual = os.path.dirname(os.path.abspath(__file__))
@@ -15,6 +32,29 @@ diretorio_atual = os.path.dirname(os.path.abspath(__file__))
 env_path = os.path.join(diretorio_atual, '.env')
 load_dotenv(dotenv_path=env_path)
 
+class QueueHandlerSemFormatacao(logging.handlers.QueueHandler):
+    """
+    QueueHandler que enfileira o registro original: a formatação da mensagem
+    e dos tracebacks fica para a thread do QueueListener, fora do event loop.
+    """
+    
+    def prepare(self, record):
+        return record
+
+# Logging não bloqueante: os registros vão para uma fila e são formatados e
+# escritos no stdout por uma thread separada, sem disputar o lock do stdout no
+# event loop. Os módulos usados pela API registram em loggers "contratus.*".
+logger = logging.getLogger("contratus")
+_fila_logs = queue.SimpleQueue()
+_handler_logs = logging.StreamHandler()
+_handler_logs.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+_listener_logs = logging.handlers.QueueListener(_fila_logs, _handler_logs)
+logger.addHandler(QueueHandlerSemFormatacao(_fila_logs))
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_listener_logs.start()
+atexit.register(_listener_logs.stop)
+
 # Configurações do Pinecone
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_HOST = os.getenv("PINECONE_HOST")
@@ -22,77 +62,561 @@ PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "brito-ai")
 
 # Configurações da OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
 EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 1024
+
+# Backend de embeddings: "openai" (padrão), "tei" para um servidor local
+# text-embeddings-inference ou "local" para um modelo ONNX (ex.: bge-small
+# quantizado em INT8) executado no próprio processo. O modelo do TEI deve gerar
+# vetores compatíveis com o índice (1024 dimensões, ou um modelo matryoshka
+# truncado para 1024); o backend "local" exige reindexar o Pinecone com o
+# mesmo modelo e a dimensão dele, e a API não inicia se as dimensões divergirem.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+TEI_URL = os.getenv("TEI_URL", "http://embed:8080")
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", os.path.join(diretorio_atual, "modelos", "bge-small-int8.onnx"))
+ONNX_TOKENIZER_PATH = os.getenv("ONNX_TOKENIZER_PATH", os.path.join(diretorio_atual, "modelos", "tokenizer.json"))
+ONNX_MAX_TOKENS = 512
+
+# Número máximo de consultas por chamada de embeddings (limite da OpenAI: 2048)
+RAG_EMBEDDING_OPENAI_BATCH_SIZE = min(int(os.getenv("RAG_EMBEDDING_OPENAI_BATCH_SIZE", "64")), 2048)
+
+# O TEI recusa lotes maiores que o seu --max-client-batch-size (padrão: 32)
+TEI_MAX_BATCH_SIZE = int(os.getenv("TEI_MAX_BATCH_SIZE", "32"))
 
-# Variáveis globais para conexão com Pinecone
-pc = None
-index = None
-connection_attempts = 0
+# Lotes maiores são divididos em sub-lotes enviados em paralelo, no máximo
+# MAX_CONCURRENT_BATCHES por vez
+MAX_CONCURRENT_BATCHES = int(os.getenv("MAX_CONCURRENT_BATCHES", "4"))
+
+# Consultas ao Pinecone simultâneas por busca em lote, para que um lote grande
+# não ocupe todas as vagas de PINECONE_SEM à frente das buscas interativas
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", "5"))
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "1024"))
+
+# Caches em memória (LRU + TTL) para embeddings de consultas e resultados de busca
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "300"))
+embedding_cache = TTLCache(maxsize=2048, ttl=SEARCH_CACHE_TTL)
+result_cache = TTLCache(maxsize=1024, ttl=SEARCH_CACHE_TTL)
+cache_stats = {
+    "embeddings": {"hits": 0, "misses": 0},
+    "resultados": {"hits": 0, "misses": 0},
+}
+
+# Intervalo (em segundos) de atualização da lista de arquivos em segundo plano
+ARQUIVOS_REFRESH_INTERVAL = int(os.getenv("ARQUIVOS_REFRESH_INTERVAL", "60"))
+
+# Controle de conexão com Pinecone
 MAX_RECONNECT_ATTEMPTS = 3
 
-def conectar_pinecone():
-    """Função para conectar ao Pinecone com retry automático"""
-    global pc, index, connection_attempts
+# Política de retry para as chamadas de embeddings (OpenAI/TEI): backoff exponencial com jitter
+_espera_exponencial = wait_exponential_jitter(initial=0.5, max=5)
+
+def esperar_retry(retry_state):
+    """
+    Respeita o cabeçalho Retry-After (ex.: respostas 429) quando presente;
+    caso contrário, usa o backoff exponencial com jitter.
+    """
+    erro = retry_state.outcome.exception()
+    headers = getattr(getattr(erro, "response", None), "headers", None)
+    retry_after = headers.get("retry-after") if headers else None
+    if retry_after:
+        try:
+            return min(float(retry_after), 30.0)
+        except ValueError:
+            pass
+    return _espera_exponencial(retry_state)
+
+def erro_transitorio(erro):
+    """
+    Indica se vale a pena repetir a chamada: falhas de conexão/timeout e
+    respostas 429 ou 5xx. Erros 4xx e erros de programação não são repetidos.
+    """
+    if isinstance(erro, (APIConnectionError, httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    status = getattr(erro, "status_code", None)
+    if status is None:
+        status = getattr(getattr(erro, "response", None), "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+# É a única camada de retry dos embeddings: o cliente da OpenAI é criado com
+# max_retries=0. As chamadas ao Pinecone não usam esta política, pois o cliente
+# do Pinecone já repete 408/429/5xx e falhas de transporte por conta própria
+# (até 4 tentativas, respeitando Retry-After) e não permite desativar isso no
+# plano de dados.
+retry_externo = retry(
+    retry=retry_if_exception(erro_transitorio),
+    stop=stop_after_attempt(3),
+    wait=esperar_retry,
+    reraise=True
+)
+
+# Cache das estatísticas do índice para não consultar o Pinecone a cada requisição
+STATS_CACHE_TTL = float(os.getenv("PINECONE_STATS_CACHE_TTL", "15"))
+_stats_cache = {"ts": 0.0, "value": None}
+
+class LimiteConcorrencia:
+    """
+    Semáforo assíncrono que limita as chamadas simultâneas a um serviço externo
+    e mantém contadores para observabilidade.
+    """
     
-    try:
-        # Inicializa o cliente Pinecone com a API V2
-        pc = Pinecone(api_key=PINECONE_API_KEY)
+    def __init__(self, limite):
+        self.limite = limite
+        self._semaforo = asyncio.Semaphore(limite)
+        self.em_andamento = 0
+        self.em_espera = 0
+        self.total = 0
+    
+    async def __aenter__(self):
+        self.em_espera += 1
+        try:
+            await self._semaforo.acquire()
+        finally:
+            self.em_espera -= 1
+        self.em_andamento += 1
+        self.total += 1
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        self.em_andamento -= 1
+        self._semaforo.release()
+    
+    def estatisticas(self):
+        return {
+            "limite": self.limite,
+            "em_andamento": self.em_andamento,
+            "em_espera": self.em_espera,
+            "total": self.total,
+        }
+
+# Limites de chamadas simultâneas por processo, abaixo das cotas dos provedores
+# (o limite de embeddings vale tanto para a OpenAI quanto para o TEI). A vaga
+# do Pinecone cobre a chamada inteira do cliente, incluindo as esperas entre as
+# tentativas que ele faz internamente.
+OPENAI_SEM = LimiteConcorrencia(int(os.getenv("OPENAI_MAX_INFLIGHT", "10")))
+PINECONE_SEM = LimiteConcorrencia(int(os.getenv("PINECONE_MAX_INFLIGHT", "20")))
+
+async def conectar_pinecone(app, tentativas=MAX_RECONNECT_ATTEMPTS):
+    """
+    Função para conectar ao Pinecone com retry automático.
+    
+    O cliente e o índice ficam em `app.state` e são reutilizados por todas as
+    requisições; o cliente só é criado uma vez por processo. Entre tentativas
+    aplica backoff exponencial limitado com jitter, sem bloquear o event loop.
+    """
+    for tentativa in range(1, tentativas + 1):
+        try:
+            # Inicializa o cliente Pinecone com a API V2
+            if app.state.pc is None:
+                app.state.pc = Pinecone(api_key=PINECONE_API_KEY)
+            
+            # Conecta ao índice com o host específico
+            index = app.state.pc.Index(PINECONE_INDEX_NAME, host=PINECONE_HOST)
+            
+            # Verifica se o índice está acessível obtendo suas estatísticas
+            stats = await asyncio.to_thread(index.describe_index_stats)
+            logger.info(
+                "Conexão com o índice '%s' estabelecida com sucesso! Total de vetores: %s",
+                PINECONE_INDEX_NAME, stats.get("total_vector_count", 0)
+            )
+            
+            app.state.index = index
+            _stats_cache["value"] = stats
+            _stats_cache["ts"] = time.time()
+            return True
+            
+        except Exception as e:
+            if tentativa < tentativas:
+                espera = min(2 ** tentativa, 10) + random.random()
+                logger.warning(
+                    "Erro ao inicializar Pinecone (tentativa %d/%d): %s. Tentando reconectar em %.1f segundos...",
+                    tentativa, tentativas, e, espera
+                )
+                await asyncio.sleep(espera)
+            else:
+                logger.error(
+                    "Erro ao inicializar Pinecone (tentativa %d/%d): %s. Número máximo de tentativas excedido.",
+                    tentativa, tentativas, e
+                )
+    
+    return False
+
+async def reconectar_pinecone(app, tentativas=MAX_RECONNECT_ATTEMPTS):
+    """
+    Reconecta ao Pinecone compartilhando uma única reconexão em andamento entre
+    todas as requisições, em vez de cada uma executar o próprio backoff.
+    """
+    tarefa = app.state.reconexao
+    if tarefa is None or tarefa.done():
+        tarefa = app.state.reconexao = asyncio.create_task(conectar_pinecone(app, tentativas))
+    return await asyncio.shield(tarefa)
+
+def reconexao_em_andamento(app):
+    """
+    Indica se já existe uma reconexão ao Pinecone em andamento.
+    """
+    return app.state.reconexao is not None and not app.state.reconexao.done()
+
+async def obter_indice(app):
+    """
+    Retorna o índice do Pinecone, tentando reconectar se necessário.
+    """
+    if app.state.index is None and not await reconectar_pinecone(app):
+        raise HTTPException(
+            status_code=503, 
+            detail="Serviço temporariamente indisponível. Não foi possível conectar ao Pinecone."
+        )
+    return app.state.index
+
+async def obter_estatisticas(index, ttl=STATS_CACHE_TTL):
+    """
+    Retorna as estatísticas do índice, reutilizando o último valor por `ttl` segundos.
+    """
+    if _stats_cache["value"] is None or time.time() - _stats_cache["ts"] > ttl:
+        async with PINECONE_SEM:
+            _stats_cache["value"] = await asyncio.to_thread(index.describe_index_stats)
+        _stats_cache["ts"] = time.time()
+    return _stats_cache["value"]
+
+async def listar_pagina_ids(index, limit=100, cursor=None):
+    """
+    Lista uma página de IDs do índice usando a paginação nativa do Pinecone.
+    
+    Args:
+        index: Índice do Pinecone
+        limit: Número máximo de IDs na página (máximo 100)
+        cursor: Token de paginação retornado pela página anterior
+        
+    Returns:
+        Tupla (lista de IDs, token da próxima página ou None)
+    """
+    async with PINECONE_SEM:
+        resposta = await asyncio.to_thread(index.list_paginated, limit=limit, pagination_token=cursor)
+    ids = [vetor.id for vetor in resposta.vectors]
+    proximo = resposta.pagination.next if resposta.pagination else None
+    return ids, proximo
+
+async def paginar_ids(index, limit=100):
+    """
+    Percorre todas as páginas de IDs do índice, produzindo uma lista por página.
+    """
+    cursor = None
+    while True:
+        ids, cursor = await listar_pagina_ids(index, limit=limit, cursor=cursor)
+        if ids:
+            yield ids
+        if not cursor:
+            break
+
+async def buscar_metadados(index, ids):
+    """
+    Busca os metadados dos vetores informados, indexados pelo ID.
+    """
+    if not ids:
+        return {}
+    async with PINECONE_SEM:
+        resposta = await asyncio.to_thread(index.fetch, ids=ids)
+    return {id: vetor.metadata or {} for id, vetor in resposta.vectors.items()}
+
+def arquivo_do_id(id):
+    """
+    Recupera o nome do arquivo a partir de um ID no formato gerado por
+    `processar_contrato` (`<nome do arquivo sem .pdf>_<posição do chunk>`).
+    
+    Returns:
+        Nome do arquivo, ou None se o ID não seguir esse formato
+    """
+    base, separador, posicao = id.rpartition("_")
+    if not separador or not base or not posicao.isdigit():
+        return None
+    return base if base.lower().endswith(".pdf") else f"{base}.pdf"
+
+async def carregar_arquivos(index):
+    """
+    Percorre todas as páginas de IDs e coleta os nomes de arquivos únicos.
+    
+    O nome do arquivo é extraído do próprio ID sempre que possível; os
+    metadados só são buscados para IDs fora do formato padrão.
+    """
+    arquivos = set()
+    async for ids in paginar_ids(index):
+        sem_nome = []
+        for id in ids:
+            arquivo = arquivo_do_id(id)
+            if arquivo:
+                arquivos.add(arquivo)
+            else:
+                sem_nome.append(id)
         
-        # Conecta ao índice com o host específico
-        index = pc.Index(PINECONE_INDEX_NAME, host=PINECONE_HOST)
+        metadados = await buscar_metadados(index, sem_nome)
+        for metadata in metadados.values():
+            arquivo = metadata.get("arquivo")
+            if arquivo:
+                arquivos.add(arquivo)
+    return arquivos
+
+async def consultar_indice(index, vector, top_k):
+    """
+    Realiza a busca vetorial no Pinecone sem bloquear o event loop.
+    """
+    async with PINECONE_SEM:
+        return await asyncio.to_thread(
+            index.query,
+            vector=vector,
+            top_k=top_k,
+            include_metadata=True
+        )
+
+def carregar_embedder_local():
+    """
+    Carrega o tokenizer e a sessão do ONNX Runtime usados pelo backend "local".
+    
+    Returns:
+        Tupla (tokenizer, sessão ONNX)
+    """
+    # Dependências só necessárias para o backend local
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+    
+    tokenizer = Tokenizer.from_file(ONNX_TOKENIZER_PATH)
+    tokenizer.enable_truncation(max_length=ONNX_MAX_TOKENS)
+    tokenizer.enable_padding()
+    sessao = ort.InferenceSession(ONNX_MODEL_PATH, providers=["CPUExecutionProvider"])
+    logger.info("Modelo de embeddings local carregado: %s", ONNX_MODEL_PATH)
+    return tokenizer, sessao
+
+def gerar_embeddings_locais(embedder, textos):
+    """
+    Gera embeddings com o modelo ONNX local (executado em CPU, fora do event loop).
+    
+    Args:
+        embedder: Tupla (tokenizer, sessão ONNX) de `carregar_embedder_local`
+        textos: Lista de textos, truncados em ONNX_MAX_TOKENS tokens
         
-        # Verifica se o índice está acessível obtendo suas estatísticas
-        stats = index.describe_index_stats()
-        print(f"Conexão com o índice '{PINECONE_INDEX_NAME}' estabelecida com sucesso!")
-        print(f"Total de vetores no índice: {stats.get('total_vector_count', 0)}")
+    Returns:
+        Lista de embeddings normalizados, na mesma ordem da entrada
+    """
+    import numpy as np
+    
+    tokenizer, sessao = embedder
+    codificados = tokenizer.encode_batch(textos)
+    entradas = {
+        "input_ids": np.array([c.ids for c in codificados], dtype=np.int64),
+        "attention_mask": np.array([c.attention_mask for c in codificados], dtype=np.int64),
+    }
+    if "token_type_ids" in {entrada.name for entrada in sessao.get_inputs()}:
+        entradas["token_type_ids"] = np.array([c.type_ids for c in codificados], dtype=np.int64)
+    
+    saida = sessao.run(None, entradas)[0]
+    # Modelos exportados sem pooling devolvem os estados de cada token; o BGE
+    # usa o token [CLS] (primeira posição) como embedding da frase
+    if saida.ndim == 3:
+        saida = saida[:, 0]
+    saida = saida / np.linalg.norm(saida, axis=1, keepdims=True)
+    return saida.tolist()
+
+def verificar_dimensao_local(embedder, stats):
+    """
+    Confere se o modelo ONNX local gera vetores com a dimensão do índice.
+    
+    O `processar_contrato.py` indexa com a OpenAI; sem reindexar o Pinecone com
+    o mesmo modelo local, todas as buscas falhariam, então a API não inicia.
+    
+    Raises:
+        RuntimeError: Se as dimensões forem diferentes
+    """
+    dimensao_modelo = len(gerar_embeddings_locais(embedder, ["teste"])[0])
+    dimensao_indice = stats.get("dimension")
+    if dimensao_indice and dimensao_modelo != dimensao_indice:
+        raise RuntimeError(
+            f"O modelo local {ONNX_MODEL_PATH} gera vetores de {dimensao_modelo} dimensões, "
+            f"mas o índice '{PINECONE_INDEX_NAME}' tem {dimensao_indice}. Reindexe o Pinecone "
+            f"com o mesmo modelo ou use EMBEDDING_BACKEND=openai."
+        )
+
+@retry_externo
+async def criar_embeddings(state, entrada, limite=None):
+    """
+    Gera os embeddings de uma lista de textos no backend configurado em
+    EMBEDDING_BACKEND (OpenAI, servidor TEI ou modelo ONNX local).
+    
+    Args:
+        state: `app.state` com os clientes da OpenAI e HTTP
+        entrada: Lista de textos
+        limite: Semáforo opcional que limita as chamadas simultâneas de um
+            mesmo lote; é mantido apenas durante cada tentativa, não durante
+            as esperas entre tentativas
         
-        # Resetar contador de tentativas após sucesso
-        connection_attempts = 0
-        return True
+    Returns:
+        Lista de embeddings, na mesma ordem da entrada
+    """
+    async with limite or nullcontext():
+        if EMBEDDING_BACKEND == "local":
+            return await asyncio.to_thread(gerar_embeddings_locais, state.embedder, entrada)
         
-    except Exception as e:
-        connection_attempts += 1
-        print(f"Erro ao inicializar Pinecone (tentativa {connection_attempts}/{MAX_RECONNECT_ATTEMPTS}): {e}")
+        if EMBEDDING_BACKEND == "tei":
+            async with OPENAI_SEM:
+                response = await state.http.post(f"{TEI_URL}/embed", json={"inputs": entrada, "truncate": True})
+            response.raise_for_status()
+            return [embedding[:EMBEDDING_DIMENSIONS] for embedding in response.json()]
         
-        if connection_attempts < MAX_RECONNECT_ATTEMPTS:
-            import time
-            print(f"Tentando reconectar em 2 segundos...")
-            time.sleep(2)
-            return conectar_pinecone()
-        else:
-            print("Número máximo de tentativas excedido. Falha na conexão com Pinecone.")
-            return False
-
-# Inicializa a conexão com Pinecone
-conexao_bem_sucedida = conectar_pinecone()
+        async with OPENAI_SEM:
+            response = await state.openai.embeddings.create(
+                input=entrada,
+                model=EMBEDDING_MODEL,
+                dimensions=EMBEDDING_DIMENSIONS
+            )
+        return [item.embedding for item in response.data]
 
 # Função para gerar embeddings
-def gerar_embedding(texto):
+async def gerar_embedding(state, texto):
     """
-    Gera um embedding usando o modelo da OpenAI.
+    Gera um embedding usando o backend de embeddings configurado.
     
     Args:
+        state: `app.state` com os clientes da OpenAI e HTTP
         texto: Texto para gerar o embedding
         
     Returns:
         Lista com o embedding
     """
-    try:
-        response = openai_client.embeddings.create(
-            input=texto,
-            model=EMBEDDING_MODEL,
-            dimensions=1024
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Erro ao gerar embedding: {e}")
-        raise
+    embedding = embedding_cache.get(texto)
+    if embedding is not None:
+        cache_stats["embeddings"]["hits"] += 1
+        return embedding
+    cache_stats["embeddings"]["misses"] += 1
+    
+    embedding = (await criar_embeddings(state, [texto]))[0]
+    embedding_cache[texto] = embedding
+    return embedding
+
+async def gerar_embeddings(state, textos):
+    """
+    Gera embeddings para vários textos, em sub-lotes de até
+    RAG_EMBEDDING_OPENAI_BATCH_SIZE textos (TEI_MAX_BATCH_SIZE no backend
+    "tei") enviados em paralelo.
+    
+    Args:
+        state: `app.state` com os clientes da OpenAI e HTTP
+        textos: Lista de textos para gerar os embeddings
+        
+    Returns:
+        Lista de embeddings, na mesma ordem dos textos de entrada
+    """
+    embeddings = [embedding_cache.get(texto) for texto in textos]
+    acertos = sum(embedding is not None for embedding in embeddings)
+    cache_stats["embeddings"]["hits"] += acertos
+    cache_stats["embeddings"]["misses"] += len(textos) - acertos
+    
+    # Textos repetidos fora do cache são gerados uma única vez
+    pendentes = list(dict.fromkeys(texto for texto, embedding in zip(textos, embeddings) if embedding is None))
+    
+    if not pendentes:
+        return embeddings
+    
+    tamanho = TEI_MAX_BATCH_SIZE if EMBEDDING_BACKEND == "tei" else RAG_EMBEDDING_OPENAI_BATCH_SIZE
+    lotes = [pendentes[i:i + tamanho] for i in range(0, len(pendentes), tamanho)]
+    semaforo = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+    
+    async def processar_lote(lote):
+        dados = await criar_embeddings(state, lote, limite=semaforo)
+        return zip(lote, dados)
+    
+    # A ordem é preservada: cada sub-lote devolve seus próprios textos
+    respostas = await asyncio.gather(*[processar_lote(lote) for lote in lotes])
+    novos = {texto: embedding for resposta in respostas for texto, embedding in resposta}
+    embedding_cache.update(novos)
+    return [embedding if embedding is not None else novos[texto]
+            for texto, embedding in zip(textos, embeddings)]
+
+def publicar_arquivos(app, arquivos):
+    """
+    Substitui de uma vez a lista de arquivos servida por `/contratos/arquivos`.
+    
+    Os nomes são guardados já ordenados, para que todos os workers sirvam os
+    mesmos bytes sob o mesmo ETag.
+    """
+    nomes = tuple(sorted(arquivos))
+    app.state.arquivos_etag = '"' + hashlib.md5("\n".join(nomes).encode("utf-8")).hexdigest() + '"'
+    app.state.arquivos_atualizado_em = time.time()
+    app.state.arquivos = nomes
+
+async def carregar_primeira_lista(app):
+    """
+    Carrega e publica a lista de arquivos pela primeira vez.
+    """
+    index = await obter_indice(app)
+    publicar_arquivos(app, await carregar_arquivos(index))
+
+async def aguardar_primeira_lista(app):
+    """
+    Aguarda a primeira carga da lista de arquivos, compartilhada entre a tarefa
+    em segundo plano e as requisições que chegam antes dela terminar; uma nova
+    carga só é iniciada se a anterior tiver falhado.
+    """
+    if app.state.arquivos_atualizado_em is not None:
+        return
+    tarefa = app.state.carga_arquivos
+    if tarefa is None or tarefa.done():
+        tarefa = app.state.carga_arquivos = asyncio.create_task(carregar_primeira_lista(app))
+    await asyncio.shield(tarefa)
+
+async def atualizar_arquivos_periodicamente(app):
+    """
+    Recarrega a lista de arquivos do índice a cada ARQUIVOS_REFRESH_INTERVAL segundos.
+    """
+    while True:
+        try:
+            if app.state.arquivos_atualizado_em is None:
+                await aguardar_primeira_lista(app)
+            elif app.state.index is not None or await reconectar_pinecone(app):
+                arquivos = await carregar_arquivos(app.state.index)
+                if app.state.arquivos_atualizado_em is None or tuple(sorted(arquivos)) != app.state.arquivos:
+                    publicar_arquivos(app, arquivos)
+        except Exception:
+            logger.exception("Erro ao atualizar lista de arquivos")
+        await asyncio.sleep(ARQUIVOS_REFRESH_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Cria os clientes do Pinecone, da OpenAI e HTTP uma única vez por processo,
+    para que todas as requisições reutilizem as mesmas conexões.
+    """
+    app.state.pc = None
+    app.state.index = None
+    app.state.reconexao = None
+    await conectar_pinecone(app)
+    app.state.openai = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    app.state.http = httpx.AsyncClient(timeout=30.0)
+    app.state.embedder = carregar_embedder_local() if EMBEDDING_BACKEND == "local" else None
+    if app.state.embedder is not None:
+        if app.state.index is not None:
+            verificar_dimensao_local(app.state.embedder, await obter_estatisticas(app.state.index))
+        else:
+            logger.warning("Sem conexão com o Pinecone: a dimensão do modelo local não foi verificada")
+    
+    app.state.arquivos = ()
+    app.state.arquivos_etag = None
+    app.state.arquivos_atualizado_em = None
+    app.state.carga_arquivos = None
+    tarefa_arquivos = asyncio.create_task(atualizar_arquivos_periodicamente(app))
+    
+    yield
+    
+    for tarefa in (tarefa_arquivos, app.state.carga_arquivos, app.state.reconexao):
+        if tarefa is not None and not tarefa.done():
+            tarefa.cancel()
+            with suppress(asyncio.CancelledError):
+                await tarefa
+    await app.state.openai.close()
+    await app.state.http.aclose()
 
 # Inicializa o FastAPI
 app = FastAPI(title="Contratus AI API", 
               description="API para consulta semântica de contratos usando Pinecone",
-              version="2.0.0")
+              version="2.0.0",
+              default_response_class=ORJSONResponse,
+              lifespan=lifespan)
 
 # Importação segura após definição de todas as classes/funções
 from llm_router import router as llm_router
@@ -108,8 +632,15 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Compressão gzip das respostas: os textos dos contratos comprimem bem
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Modelos de dados
+# Os resultados vêm direto dos metadados do Pinecone, então os endpoints usam
+# `model_construct` para montar as respostas sem revalidar cada item.
 class ContratoBase(BaseModel):
+    model_config = ConfigDict(extra="ignore", validate_assignment=False)
+    
     arquivo: str
     texto: str
 
@@ -117,18 +648,44 @@ class ContratoResponse(ContratoBase):
     score: float = 0.0
     
 class SearchResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore", validate_assignment=False)
+    
     resultados: List[ContratoResponse]
     total: int
+    proximo: Optional[str] = None
+
+# Campos que podem ser selecionados com `?fields=` em `/contratos/busca`
+CAMPOS_CONTRATO = ("arquivo", "texto", "score")
+
+def projetar_campos(resposta, campos):
+    """
+    Serializa a resposta da busca, reduzindo cada resultado aos campos pedidos
+    quando `campos` é informado; `total` e `proximo` são sempre mantidos.
+    """
+    if campos:
+        resposta = {
+            **resposta,
+            "resultados": [{campo: contrato[campo] for campo in campos} for contrato in resposta["resultados"]]
+        }
+    return ORJSONResponse(resposta)
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    limit: int = Field(5, ge=1, le=100)
+
+class BatchSearchResponse(BaseModel):
+    resultados: List[SearchResponse]
+    total: int
 
 @app.get("/")
-def read_root():
+async def read_root(request: Request):
     # Verifica se a conexão com Pinecone está ativa
-    global index
+    index = request.app.state.index
     
     try:
         if index:
-            # Tenta uma operação simples para verificar a conexão
-            stats = index.describe_index_stats()
+            # Tenta uma operação simples para verificar a conexão (com cache)
+            stats = await obter_estatisticas(index)
             return {
                 "status": "online", 
                 "message": "Contratus AI API está funcionando com Pinecone!",
@@ -136,8 +693,9 @@ def read_root():
                 "total_vetores": stats.get("total_vector_count", 0)
             }
         else:
-            # Tenta reconectar
-            if conectar_pinecone():
+            # Tenta reconectar uma única vez, sem o backoff completo, e não
+            # espera uma reconexão que já esteja em andamento
+            if not reconexao_em_andamento(request.app) and await reconectar_pinecone(request.app, tentativas=1):
                 return {
                     "status": "online", 
                     "message": "Contratus AI API está funcionando com Pinecone!",
@@ -150,8 +708,9 @@ def read_root():
                     "pinecone_status": "desconectado"
                 }
     except Exception as e:
-        # Tenta reconectar em caso de erro
-        conectar_pinecone()
+        # Tenta reconectar em caso de erro (uma única tentativa)
+        if not reconexao_em_andamento(request.app):
+            await reconectar_pinecone(request.app, tentativas=1)
         return {
             "status": "degradado", 
             "message": "API está online, mas com problemas de conexão ao Pinecone.",
@@ -159,180 +718,281 @@ def read_root():
         }
 
 @app.get("/contratos", response_model=SearchResponse)
-def listar_contratos(
-    skip: int = Query(0, description="Número de registros para pular"),
-    limit: int = Query(10, description="Número máximo de registros para retornar")
+async def listar_contratos(
+    request: Request,
+    skip: int = Query(0, ge=0, description="Número de registros para pular (prefira `cursor`)"),
+    cursor: Optional[str] = Query(None, description="Token de paginação retornado em `proximo` pela página anterior"),
+    limit: int = Query(10, ge=1, le=100, description="Número máximo de registros para retornar")
 ):
     """
     Lista todos os contratos disponíveis com paginação.
     """
-    global index
-    
     # Verifica se a conexão com Pinecone está ativa
-    if not index and not conectar_pinecone():
-        raise HTTPException(
-            status_code=503, 
-            detail="Serviço temporariamente indisponível. Não foi possível conectar ao Pinecone."
-        )
+    index = await obter_indice(request.app)
     
     try:
-        # Obtém estatísticas do índice
-        stats = index.describe_index_stats()
+        # Obtém estatísticas do índice (com cache)
+        stats = await obter_estatisticas(index)
         total = stats.get("total_vector_count", 0)
         
-        # Limitação: Pinecone não suporta paginação nativa como MongoDB
-        # Vamos usar uma abordagem simplificada para demonstração
-        # Em produção, você pode querer implementar uma solução mais robusta
-        
-        # Busca genérica para obter todos os documentos
-        # Nota: Isso não é eficiente para grandes conjuntos de dados
-        # Criamos um vetor de zeros com a dimensão correta (1024 para text-embedding-3-large)
-        dummy_vector = [0.0] * 1024
-        
-        # Fazemos uma consulta com um limite alto
-        resultados_query = index.query(
-            vector=dummy_vector,
-            top_k=skip + limit,
-            include_metadata=True
-        )
-        
-        # Aplica paginação manualmente
-        matches = resultados_query.matches[skip:skip+limit] if resultados_query.matches else []
+        # Lista os IDs da página atual e busca apenas os metadados deles,
+        # sem passar pela busca vetorial (ANN). O `skip` é mantido por
+        # compatibilidade: as páginas anteriores são percorridas só pelos IDs,
+        # em páginas de até 100 IDs, e a última termina exatamente em
+        # skip + limit para que `proximo` aponte logo após o último item.
+        ids = []
+        proximo = cursor
+        while True:
+            tamanho = min(100, skip + limit - len(ids))
+            pagina, proximo = await listar_pagina_ids(index, limit=tamanho, cursor=proximo)
+            ids.extend(pagina)
+            if len(ids) >= skip + limit or not proximo:
+                break
+        ids = ids[skip:skip + limit]
+        metadados = await buscar_metadados(index, ids)
         
         resultados = []
-        for match in matches:
-            resultados.append(ContratoResponse(
-                arquivo=match.metadata.get("arquivo", ""),
-                texto=match.metadata.get("texto", ""),
-                score=match.score
+        for id in ids:
+            metadata = metadados.get(id)
+            if metadata is None:
+                continue
+            resultados.append(ContratoResponse.model_construct(
+                arquivo=metadata.get("arquivo", ""),
+                texto=metadata.get("texto", "")
             ))
         
-        return SearchResponse(resultados=resultados, total=total)
+        return SearchResponse.model_construct(resultados=resultados, total=total, proximo=proximo)
     
     except Exception as e:
-        print(f"Erro ao listar contratos: {e}")
-        
-        # Tenta reconectar em caso de erro
-        if conectar_pinecone():
-            # Tenta novamente após reconexão bem-sucedida
-            try:
-                return listar_contratos(skip=skip, limit=limit)
-            except Exception:
-                pass
-                
+        logger.exception("Erro ao listar contratos")
         raise HTTPException(status_code=500, detail=f"Erro ao listar contratos: {str(e)}")
 
+@app.get("/contratos/stream")
+async def exportar_contratos(request: Request):
+    """
+    Exporta todos os contratos em NDJSON (um objeto JSON por linha).
+    
+    Os contratos são enviados à medida que cada página de IDs é lida do
+    Pinecone, então apenas uma página fica em memória por vez.
+    """
+    # Verifica se a conexão com Pinecone está ativa
+    index = await obter_indice(request.app)
+    
+    async def gerar_linhas():
+        try:
+            async for ids in paginar_ids(index):
+                metadados = await buscar_metadados(index, ids)
+                for id in ids:
+                    metadata = metadados.get(id)
+                    if metadata is None:
+                        continue
+                    yield orjson.dumps({
+                        "arquivo": metadata.get("arquivo", ""),
+                        "texto": metadata.get("texto", "")
+                    }) + b"\n"
+        except Exception:
+            logger.exception("Erro ao exportar contratos")
+            raise
+    
+    return StreamingResponse(gerar_linhas(), media_type="application/x-ndjson")
+
 @app.get("/contratos/busca", response_model=SearchResponse)
-def buscar_contratos(
+async def buscar_contratos(
+    request: Request,
     q: str = Query(..., description="Consulta para busca"),
-    limit: int = Query(5, description="Número máximo de resultados")
+    limit: int = Query(5, ge=1, le=100, description="Número máximo de resultados"),
+    fields: Optional[str] = Query(None, description="Campos a retornar, separados por vírgula (ex.: `arquivo,score`)")
 ):
     """
-    Realiza uma busca semântica nos contratos usando o Pinecone com embeddings da OpenAI.
-    """
-    global index
+    Realiza uma busca semântica nos contratos usando o Pinecone, com embeddings
+    gerados pelo backend configurado em EMBEDDING_BACKEND.
     
+    Com `fields`, cada item de `resultados` traz apenas os campos pedidos e,
+    portanto, não segue o esquema `ContratoResponse` documentado; `total` e
+    `proximo` continuam presentes.
+    """
     if not q:
         raise HTTPException(status_code=400, detail="A consulta não pode estar vazia")
     
+    campos = None
+    if fields:
+        campos = [campo.strip() for campo in fields.split(",") if campo.strip()]
+        invalidos = [campo for campo in campos if campo not in CAMPOS_CONTRATO]
+        if invalidos:
+            raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalidos)}")
+    
     # Verifica se a conexão com Pinecone está ativa
-    if not index and not conectar_pinecone():
-        raise HTTPException(
-            status_code=503, 
-            detail="Serviço temporariamente indisponível. Não foi possível conectar ao Pinecone."
-        )
+    index = await obter_indice(request.app)
+    
+    # Consultas repetidas são respondidas direto do cache
+    chave_cache = (q.strip().lower(), limit)
+    resposta = result_cache.get(chave_cache)
+    if resposta is not None:
+        cache_stats["resultados"]["hits"] += 1
+        return projetar_campos(resposta, campos)
+    cache_stats["resultados"]["misses"] += 1
     
     try:
-        # Gera o embedding da consulta usando o modelo da OpenAI
-        query_embedding = gerar_embedding(q)
+        # Gera o embedding da consulta no backend configurado
+        query_embedding = await gerar_embedding(request.app.state, q)
         
         # Realiza a busca vetorial no Pinecone
-        resultados_query = index.query(
-            vector=query_embedding,
-            top_k=limit,
-            include_metadata=True
-        )
-        
-        resultados = []
-        for match in resultados_query.matches:
-            resultados.append(ContratoResponse(
-                arquivo=match.metadata.get("arquivo", ""),
-                texto=match.metadata.get("texto", ""),
-                score=match.score
-            ))
+        resultados_query = await consultar_indice(index, query_embedding, limit)
         
-        total = len(resultados)
+        # Monta a resposta como dicionários simples e devolve via ORJSONResponse,
+        # sem passar pelos modelos Pydantic (o formato segue SearchResponse)
+        resultados = [
+            {
+                "arquivo": match.metadata.get("arquivo", ""),
+                "texto": match.metadata.get("texto", ""),
+                "score": match.score
+            }
+            for match in resultados_query.matches
+        ]
         
-        return SearchResponse(resultados=resultados, total=total)
+        resposta = {"resultados": resultados, "total": len(resultados), "proximo": None}
+        result_cache[chave_cache] = resposta
+        return projetar_campos(resposta, campos)
     
     except Exception as e:
-        print(f"Erro na busca: {e}")
-        
-        # Tenta reconectar em caso de erro
-        if conectar_pinecone():
-            # Tenta novamente após reconexão bem-sucedida
-            try:
-                return buscar_contratos(q=q, limit=limit)
-            except Exception:
-                pass
-                
+        logger.exception("Erro na busca: q=%r", q)
         raise HTTPException(status_code=500, detail=f"Erro ao realizar a busca: {str(e)}")
 
-@app.get("/contratos/arquivos")
-def listar_arquivos():
+@app.post("/contratos/busca/batch", response_model=BatchSearchResponse)
+async def buscar_contratos_batch(request: Request, batch: BatchSearchRequest):
     """
-    Lista todos os nomes de arquivos únicos no índice.
+    Realiza várias buscas semânticas de uma vez, gerando os embeddings em
+    lotes no backend configurado e consultando o Pinecone em paralelo.
     """
-    global index
+    queries = [q.strip() for q in batch.queries]
+    if not queries or not all(queries):
+        raise HTTPException(status_code=400, detail="As consultas não podem estar vazias")
     
-    # Verifica se a conexão com Pinecone está ativa
-    if not index and not conectar_pinecone():
+    if len(queries) > MAX_BATCH_QUERIES:
         raise HTTPException(
-            status_code=503, 
-            detail="Serviço temporariamente indisponível. Não foi possível conectar ao Pinecone."
+            status_code=400,
+            detail=f"Número máximo de consultas por lote é {MAX_BATCH_QUERIES}"
         )
     
+    # Verifica se a conexão com Pinecone está ativa
+    index = await obter_indice(request.app)
+    
     try:
-        # Obtém estatísticas do índice
-        stats = index.describe_index_stats()
-        total = stats.get("total_vector_count", 0)
+        # Embeddings em sub-lotes paralelos; a ordem das consultas é preservada
+        embeddings = await gerar_embeddings(request.app.state, queries)
         
-        # Limitação: Pinecone não tem uma função direta para obter valores distintos
-        # Vamos usar uma abordagem simplificada para demonstração
+        # Executa as consultas ao Pinecone concorrentemente, no máximo
+        # MAX_CONCURRENT_QUERIES por vez nesta requisição
+        semaforo = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
         
-        # Busca genérica para obter documentos
-        # Nota: Isso não é eficiente para grandes conjuntos de dados
-        # Criamos um vetor de zeros com a dimensão correta (1024 para text-embedding-3-large)
-        dummy_vector = [0.0] * 1024
+        async def consultar(embedding):
+            async with semaforo:
+                return await consultar_indice(index, embedding, batch.limit)
         
-        # Fazemos uma consulta com um limite alto
-        resultados_query = index.query(
-            vector=dummy_vector,
-            top_k=min(total, 1000),  # Limita a 1000 para evitar problemas de performance
-            include_metadata=True
-        )
+        respostas = await asyncio.gather(*[consultar(embedding) for embedding in embeddings])
         
-        # Extrai nomes de arquivos únicos
-        arquivos = set()
-        for match in resultados_query.matches:
-            arquivo = match.metadata.get("arquivo")
-            if arquivo:
-                arquivos.add(arquivo)
+        resultados = []
+        for resultados_query in respostas:
+            contratos = [
+                ContratoResponse.model_construct(
+                    arquivo=match.metadata.get("arquivo", ""),
+                    texto=match.metadata.get("texto", ""),
+                    score=match.score
+                )
+                for match in resultados_query.matches
+            ]
+            resultados.append(SearchResponse.model_construct(resultados=contratos, total=len(contratos)))
         
-        return {"arquivos": list(arquivos)}
+        return BatchSearchResponse.model_construct(resultados=resultados, total=len(resultados))
     
     except Exception as e:
-        print(f"Erro ao listar arquivos: {e}")
-        
-        # Tenta reconectar em caso de erro
-        if conectar_pinecone():
-            # Tenta novamente após reconexão bem-sucedida
-            try:
-                return listar_arquivos()
-            except Exception:
-                pass
-                
+        logger.exception("Erro na busca em lote: %d consultas", len(queries))
+        raise HTTPException(status_code=500, detail=f"Erro ao realizar a busca em lote: {str(e)}")
+
+def nao_modificado(request, etag, atualizado_em):
+    """
+    Verifica as pré-condições If-None-Match/If-Modified-Since da requisição.
+    
+    If-None-Match aceita uma lista de ETags, `*` e ETags fracas (`W/`); quando
+    presente, If-Modified-Since é ignorado.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in etags or etag in etags
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            data = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if data.tzinfo is None:
+            data = data.replace(tzinfo=timezone.utc)
+        # Last-Modified tem resolução de segundos
+        return int(atualizado_em) <= data.timestamp()
+    return False
+
+@app.get("/contratos/arquivos")
+async def listar_arquivos(request: Request):
+    """
+    Lista todos os nomes de arquivos únicos no índice.
+    
+    A lista é mantida em memória e atualizada em segundo plano; os cabeçalhos
+    ETag/Last-Modified permitem que o cliente reutilize a resposta (304).
+    """
+    state = request.app.state
+    
+    # Antes da primeira atualização, aguarda a carga em andamento em vez de
+    # percorrer o índice novamente a cada requisição
+    try:
+        await aguardar_primeira_lista(request.app)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Erro ao listar arquivos")
         raise HTTPException(status_code=500, detail=f"Erro ao listar arquivos: {str(e)}")
+    
+    headers = {
+        "ETag": state.arquivos_etag,
+        "Last-Modified": formatdate(state.arquivos_atualizado_em, usegmt=True),
+    }
+    if nao_modificado(request, state.arquivos_etag, state.arquivos_atualizado_em):
+        return Response(status_code=304, headers=headers)
+    
+    response = ORJSONResponse({"arquivos": state.arquivos})
+    response.headers.update(headers)
+    return response
+
+@app.get("/admin/cache/stats")
+async def estatisticas_cache():
+    """
+    Retorna acertos, falhas e ocupação dos caches de embeddings e resultados.
+    """
+    return {
+        "embeddings": {**cache_stats["embeddings"], "tamanho": len(embedding_cache), "capacidade": embedding_cache.maxsize},
+        "resultados": {**cache_stats["resultados"], "tamanho": len(result_cache), "capacidade": result_cache.maxsize},
+        "ttl": SEARCH_CACHE_TTL,
+    }
+
+@app.get("/admin/concorrencia/stats")
+async def estatisticas_concorrencia():
+    """
+    Retorna as chamadas em andamento, em espera e totais para OpenAI e Pinecone.
+    """
+    return {
+        "openai": OPENAI_SEM.estatisticas(),
+        "pinecone": PINECONE_SEM.estatisticas(),
+    }
 
 if __name__ == "__main__":
-    uvicorn.run("api_pinecone:app", host="127.0.0.1", port=8000, reload=True)
+    # loop/http "auto" usam uvloop e httptools quando instalados (o uvloop não
+    # existe no Windows). Cada worker cria seus próprios clientes no lifespan.
+    uvicorn.run(
+        "api_pinecone:app",
+        host=os.getenv("API_HOST", "127.0.0.1"),
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv("API_WORKERS", min(os.cpu_count() or 1, 4)))
+    )
@@ -1,4 +1,6 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import logging
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from typing import List
 from openai import OpenAI
@@ -6,6 +8,8 @@ import os
 import time
 from shared import buscar_contratos
 
+logger = logging.getLogger("contratus.llm")
+
 router = APIRouter()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -18,8 +22,14 @@ class QuestionResponse(BaseModel):
     sources: List[dict]
 
 @router.post("/ask", response_model=QuestionResponse)
-async def ask_question(request: QuestionRequest):
-    """Responde a perguntas sobre contratos usando o LLM com base nos resultados da busca semântica."""
+async def ask_question(request: QuestionRequest, http_request: Request):
+    """
+    Responde a perguntas sobre contratos usando o LLM com base nos resultados da busca semântica.
+    
+    As chamadas síncronas à OpenAI e ao Pinecone rodam em threads, sem bloquear
+    o event loop compartilhado com os demais endpoints; a busca reutiliza o
+    índice criado no lifespan da aplicação.
+    """
     start_time = time.time()
     
     try:
@@ -27,25 +37,28 @@ async def ask_question(request: QuestionRequest):
         if not request.question or not request.question.strip():
             raise HTTPException(status_code=400, detail="A pergunta não pode estar vazia")
             
-        print(f"[LLM] Recebida pergunta: '{request.question}' (max_results={request.max_results})")
+        logger.info("Recebida pergunta: '%s' (max_results=%s)", request.question, request.max_results)
         
         # 1. Busca direta no Pinecone usando a função buscar_documentos
         # IMPORTANTE: Contornando a função buscar_contratos para evitar incompatibilidade de formatos
         from pinecone_utils import buscar_documentos
         
-        print(f"[LLM] Realizando busca semântica direta...")
+        logger.info("Realizando busca semântica direta...")
         try:
-            # Busca direta nos documentos
-            documentos = buscar_documentos(request.question, request.max_results)
+            # Busca direta nos documentos, reutilizando o índice da aplicação
+            index = getattr(http_request.app.state, "index", None)
+            documentos = await asyncio.to_thread(
+                buscar_documentos, request.question, request.max_results, index
+            )
             
             # Verifica se há resultados
             if not documentos or len(documentos) == 0:
-                print(f"[LLM] Nenhum documento relevante encontrado.")
+                logger.info("Nenhum documento relevante encontrado.")
                 raise HTTPException(status_code=404, detail="Nenhum documento relevante encontrado.")
             
-            print(f"[LLM] Encontrados {len(documentos)} documentos relevantes.")
+            logger.info("Encontrados %s documentos relevantes.", len(documentos))
         except Exception as e:
-            print(f"[LLM] Erro na busca: {str(e)}")
+            logger.error("Erro na busca: %s", str(e))
             raise HTTPException(status_code=500, detail=f"Erro ao processar a consulta: {str(e)}")
         
         # 3. Prepara contexto para o LLM diretamente dos documentos encontrados
@@ -56,10 +69,11 @@ async def ask_question(request: QuestionRequest):
 
         # 4. Geração da resposta com o LLM
         modelo = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        print(f"[LLM] Gerando resposta com o modelo {modelo}...")
+        logger.info("Gerando resposta com o modelo %s...", modelo)
         
         try:
-            resposta_final = client.chat.completions.create(
+            resposta_final = await asyncio.to_thread(
+                client.chat.completions.create,
                 model=modelo,
                 messages=[
                     {
@@ -82,7 +96,7 @@ async def ask_question(request: QuestionRequest):
             
             answer = resposta_final.choices[0].message.content
         except Exception as e:
-            print(f"[LLM] Erro ao gerar resposta: {str(e)}")
+            logger.error("Erro ao gerar resposta: %s", str(e))
             raise HTTPException(status_code=500, detail="Erro ao gerar resposta. Tente novamente.")
 
         # 5. Prepara e retorna a resposta diretamente dos documentos
@@ -95,7 +109,7 @@ async def ask_question(request: QuestionRequest):
         }
         
         elapsed_time = time.time() - start_time
-        print(f"[LLM] Resposta gerada em {elapsed_time:.2f} segundos.")
+        logger.info("Resposta gerada em %.2f segundos.", elapsed_time)
         
         return response
         
@@ -103,5 +117,5 @@ async def ask_question(request: QuestionRequest):
         # Repassa exceções HTTP
         raise
     except Exception as e:
-        print(f"[LLM] Erro ao processar pergunta: {str(e)}")
+        logger.error("Erro ao processar pergunta: %s", str(e))
         raise HTTPException(status_code=500, detail=f"Erro ao processar pergunta: {str(e)}")
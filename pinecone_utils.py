@@ -1,9 +1,12 @@
 import os
+import logging
 from pinecone import Pinecone
 from openai import OpenAI
 from dotenv import load_dotenv
 import time
 
+logger = logging.getLogger("contratus.pinecone_utils")
+
 # Carrega as variáveis de ambiente
 diretorio_atual = os.path.dirname(os.path.abspath(__file__))
 env_path = os.path.join(diretorio_atual, '.env')
@@ -36,12 +39,12 @@ def inicializar_pinecone():
         
         # Verifica se o índice está acessível obtendo suas estatísticas
         stats = index.describe_index_stats()
-        print(f"Conexão com o índice '{INDEX_NAME}' estabelecida com sucesso!")
-        print(f"Total de vetores no índice: {stats.get('total_vector_count', 0)}")
+        logger.info("Conexão com o índice '%s' estabelecida com sucesso!", INDEX_NAME)
+        logger.info("Total de vetores no índice: %s", stats.get('total_vector_count', 0))
         
         return index
     except Exception as e:
-        print(f"Erro ao conectar ao Pinecone: {e}")
+        logger.error("Erro ao conectar ao Pinecone: %s", e)
         raise
 
 def gerar_embedding(texto):
@@ -61,7 +64,7 @@ def gerar_embedding(texto):
         )
         return response.data[0].embedding
     except Exception as e:
-        print(f"Erro ao gerar embedding: {e}")
+        logger.error("Erro ao gerar embedding: %s", e)
         raise
 
 def processar_e_indexar_documento(texto, metadata, id=None, index=None):
@@ -94,22 +97,23 @@ def processar_e_indexar_documento(texto, metadata, id=None, index=None):
         
         return id
     except Exception as e:
-        print(f"Erro ao indexar documento: {e}")
+        logger.error("Erro ao indexar documento: %s", e)
         raise
 
-def buscar_documentos(query, top_k=5):
+def buscar_documentos(query, top_k=5, index=None):
     """
     Realiza uma busca semântica no Pinecone.
     
     Args:
         query: Texto da consulta
         top_k: Número máximo de resultados
+        index: Índice Pinecone (opcional, será inicializado se None)
     
     Returns:
         Lista de documentos mais relevantes
     """
     if not query or not query.strip():
-        print("Erro: consulta vazia enviada para buscar_documentos")
+        logger.error("Consulta vazia enviada para buscar_documentos")
         return []
         
     try:
@@ -117,7 +121,7 @@ def buscar_documentos(query, top_k=5):
         query_processada = query.strip()
         if len(query_processada) > 1000:
             query_processada = query_processada[:1000]
-            print(f"Aviso: consulta truncada para 1000 caracteres. Original: '{query[:30]}...'")
+            logger.warning("Consulta truncada para 1000 caracteres. Original: '%s...'", query[:30])
         
         # Verifica se é uma consulta sobre valores ou uma pessoa específica
         consulta_sobre_valor = any(termo in query_processada.lower() for termo in ["valor", "preço", "custo", "aluguel", "taxa", "multa", "reais", "r$", "pagamento"])
@@ -126,25 +130,26 @@ def buscar_documentos(query, top_k=5):
         # Enriquece a consulta para melhorar os resultados
         if consulta_sobre_valor:
             query_processada = f"{query_processada} valor aluguel preço pagamento R$"
-            print(f"Consulta sobre valores detectada, consulta enriquecida: '{query_processada[:50]}...'")
+            logger.info("Consulta sobre valores detectada, consulta enriquecida: '%s...'", query_processada[:50])
         elif consulta_sobre_pessoa:
             query_processada = f"{query_processada} nome cpf rg identificação contratante locatário inquilino"
-            print(f"Consulta sobre pessoa detectada, consulta enriquecida: '{query_processada[:50]}...'")
+            logger.info("Consulta sobre pessoa detectada, consulta enriquecida: '%s...'", query_processada[:50])
             
         # Gera o embedding da consulta usando o modelo da OpenAI
         try:
             query_embedding = gerar_embedding(query_processada)
         except Exception as e:
-            print(f"Erro ao gerar embedding para a consulta: {e}")
+            logger.error("Erro ao gerar embedding para a consulta: %s", e)
             raise ValueError(f"Não foi possível gerar embedding para a consulta: {str(e)}")
         
-        # Inicializa o Pinecone e conecta ao índice
+        # Usa o índice fornecido ou inicializa o Pinecone e conecta ao índice
         try:
-            index = inicializar_pinecone()
+            if index is None:
+                index = inicializar_pinecone()
             if not index:
                 raise ConnectionError("Não foi possível conectar ao Pinecone")
         except Exception as e:
-            print(f"Erro ao conectar ao Pinecone: {e}")
+            logger.error("Erro ao conectar ao Pinecone: %s", e)
             raise ConnectionError(f"Falha na conexão com o Pinecone: {str(e)}")
         
         # Realiza a busca
@@ -157,11 +162,11 @@ def buscar_documentos(query, top_k=5):
             )
             
             if not resultados or not hasattr(resultados, 'matches') or not resultados.matches:
-                print(f"Aviso: nenhum resultado encontrado para a consulta '{query_processada[:30]}...'")
+                logger.warning("Nenhum resultado encontrado para a consulta '%s...'", query_processada[:30])
                 return []
                 
         except Exception as e:
-            print(f"Erro ao realizar busca no Pinecone: {e}")
+            logger.error("Erro ao realizar busca no Pinecone: %s", e)
             raise ValueError(f"Falha na busca vetorial: {str(e)}")
         
         # Formata os resultados
@@ -170,7 +175,7 @@ def buscar_documentos(query, top_k=5):
             try:
                 # Verifica se match tem os atributos necessários
                 if not hasattr(match, 'metadata') or not match.metadata:
-                    print(f"Aviso: match sem metadados válidos: {match}")
+                    logger.warning("Match sem metadados válidos: %s", match)
                     continue
                     
                 # Extrai os dados com verificação de segurança
@@ -187,35 +192,35 @@ def buscar_documentos(query, top_k=5):
                     if campo in match.metadata and match.metadata[campo]:
                         doc[campo] = match.metadata[campo]
                         if campo == "valores_monetarios" and match.metadata[campo]:
-                            print(f"Valores monetários em {doc['arquivo']}: {match.metadata[campo]}")
+                            logger.info("Valores monetários em %s: %s", doc['arquivo'], match.metadata[campo])
                         elif campo == "cpfs" and match.metadata[campo]:
-                            print(f"CPFs em {doc['arquivo']}: {match.metadata[campo]}")
+                            logger.info("CPFs em %s: %s", doc['arquivo'], match.metadata[campo])
                         elif campo == "nomes" and match.metadata[campo]:
-                            print(f"Nomes em {doc['arquivo']}: {match.metadata[campo]}")
+                            logger.info("Nomes em %s: %s", doc['arquivo'], match.metadata[campo])
                     else:
                         doc[campo] = []
                 
                 # Verifica se os campos essenciais estão presentes
                 if not doc["arquivo"] or not doc["texto"]:
-                    print(f"Aviso: documento com campos incompletos: {doc}")
+                    logger.warning("Documento com campos incompletos: %s", doc)
                     continue
                     
                 documentos.append(doc)
             except Exception as e:
-                print(f"Erro ao processar match: {e}")
+                logger.error("Erro ao processar match: %s", e)
                 continue
         
-        print(f"Busca bem-sucedida: {len(documentos)} documentos encontrados para '{query_processada[:30]}...'")
+        logger.info("Busca bem-sucedida: %s documentos encontrados para '%s...'", len(documentos), query_processada[:30])
         return documentos
         
     except ValueError as ve:
-        print(f"Erro de validação na busca: {ve}")
+        logger.error("Erro de validação na busca: %s", ve)
         raise ve
     except ConnectionError as ce:
-        print(f"Erro de conexão na busca: {ce}")
+        logger.error("Erro de conexão na busca: %s", ce)
         raise ce
     except Exception as e:
-        print(f"Erro inesperado ao buscar documentos: {e}")
+        logger.error("Erro inesperado ao buscar documentos: %s", e)
         return []
 
 def listar_todos_documentos(limit=100):
@@ -239,32 +244,38 @@ def listar_todos_documentos(limit=100):
         if total == 0:
             return [], 0
         
-        # Para listar documentos, precisamos fazer uma consulta genérica
-        # já que a nova API do Pinecone não tem um método direto para listar todos os vetores
+        # Percorre os IDs com a paginação nativa do Pinecone e busca apenas os
+        # metadados, sem executar uma busca vetorial com um vetor de zeros
         try:
-            # Criamos um vetor de zeros com a dimensão correta (1536 para text-embedding-3-small)
-            dummy_vector = [0.0] * 1536
-            
-            # Fazemos uma consulta com um limite alto
-            resultados = index.query(
-                vector=dummy_vector,
-                top_k=min(limit, 10000),  # Limitado a 10000 pela API
-                include_metadata=True
-            )
-            
             documentos = []
-            for match in resultados.matches:
-                documentos.append({
-                    "id": match.id,
-                    "arquivo": match.metadata.get("arquivo", ""),
-                    "texto": match.metadata.get("texto", "")
-                })
+            cursor = None
+            while len(documentos) < limit:
+                pagina = index.list_paginated(
+                    limit=min(limit - len(documentos), 100),  # Limitado a 100 por página pela API
+                    pagination_token=cursor
+                )
+                ids = [vetor.id for vetor in pagina.vectors]
+                if ids:
+                    vetores = index.fetch(ids=ids).vectors
+                    for id in ids:
+                        if id not in vetores:
+                            continue
+                        metadata = vetores[id].metadata or {}
+                        documentos.append({
+                            "id": id,
+                            "arquivo": metadata.get("arquivo", ""),
+                            "texto": metadata.get("texto", "")
+                        })
+                
+                cursor = pagina.pagination.next if pagina.pagination else None
+                if not cursor:
+                    break
             
             return documentos, total
         
         except Exception as e:
-            print(f"Erro ao listar documentos: {e}")
+            logger.error("Erro ao listar documentos: %s", e)
             return [], total
     except Exception as e:
-        print(f"Erro ao inicializar Pinecone: {e}")
+        logger.error("Erro ao inicializar Pinecone: %s", e)
         return [], 0
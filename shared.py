@@ -1,8 +1,11 @@
+import logging
 from fastapi import HTTPException
 from pydantic import BaseModel
 from typing import List
 from pinecone_utils import buscar_documentos
 
+logger = logging.getLogger("contratus.shared")
+
 class ContratoResponse(BaseModel):
     arquivo: str
     texto: str
@@ -18,40 +21,40 @@ def buscar_contratos(q: str, limit: int = 50):
     """
     # Validação da consulta
     if not q or not q.strip():
-        print("Erro: consulta vazia enviada para buscar_contratos")
+        logger.error("Consulta vazia enviada para buscar_contratos")
         raise HTTPException(status_code=400, detail="A consulta não pode estar vazia")
     
-    print(f"Iniciando busca de contratos para: '{q[:50]}...' (limit={limit})")
+    logger.info("Iniciando busca de contratos para: '%s...' (limit=%s)", q[:50], limit)
     
     try:
         # Realiza a busca semântica com tratamento de exceções específicas
         try:
             documentos = buscar_documentos(q, limit)
         except ValueError as ve:
-            print(f"Erro de validação na busca de documentos: {ve}")
+            logger.error("Erro de validação na busca de documentos: %s", ve)
             raise HTTPException(status_code=400, detail=f"Erro na consulta: {str(ve)}")
         except ConnectionError as ce:
-            print(f"Erro de conexão na busca de documentos: {ce}")
+            logger.error("Erro de conexão na busca de documentos: %s", ce)
             raise HTTPException(status_code=503, detail=f"Serviço indisponível: {str(ce)}")
         except Exception as e:
-            print(f"Erro inesperado na busca de documentos: {e}")
+            logger.error("Erro inesperado na busca de documentos: %s", e)
             raise HTTPException(status_code=500, detail=f"Erro interno ao processar a consulta: {str(e)}")
         
         # Verifica se documentos é uma lista válida
         if documentos is None:
-            print("Erro: buscar_documentos retornou None")
+            logger.error("buscar_documentos retornou None")
             raise HTTPException(status_code=500, detail="Erro interno: resultado nulo da busca")
             
         if not isinstance(documentos, list):
-            print(f"Erro: buscar_documentos retornou um formato inesperado: {type(documentos)}")
+            logger.error("buscar_documentos retornou um formato inesperado: %s", type(documentos))
             raise HTTPException(status_code=500, detail=f"Erro interno: formato inválido ({type(documentos).__name__})")
         
         # Verifica se há resultados
         if len(documentos) == 0:
-            print(f"Nenhum resultado encontrado para a consulta: '{q[:50]}...'")
+            logger.info("Nenhum resultado encontrado para a consulta: '%s...'", q[:50])
             return SearchResponse(resultados=[], total=0)
         
-        print(f"Processando {len(documentos)} documentos encontrados")
+        logger.info("Processando %s documentos encontrados", len(documentos))
         
         # Processa os resultados
         resultados = []
@@ -59,7 +62,7 @@ def buscar_contratos(q: str, limit: int = 50):
             try:
                 # Verifica se doc é um dicionário
                 if not isinstance(doc, dict):
-                    print(f"Aviso: documento {i} em formato inesperado: {type(doc)}")
+                    logger.warning("Documento %s em formato inesperado: %s", i, type(doc))
                     continue
                 
                 # Verifica campos obrigatórios
@@ -68,7 +71,7 @@ def buscar_contratos(q: str, limit: int = 50):
                 score = doc.get("score", 0.0)
                 
                 if not arquivo or not texto:
-                    print(f"Aviso: documento {i} com campos obrigatórios ausentes: {doc}")
+                    logger.warning("Documento %s com campos obrigatórios ausentes: %s", i, doc)
                     continue
                 
                 # Converte score para float se necessário
@@ -76,7 +79,7 @@ def buscar_contratos(q: str, limit: int = 50):
                     try:
                         score = float(score)
                     except (ValueError, TypeError):
-                        print(f"Aviso: score inválido no documento {i}: {score}")
+                        logger.warning("Score inválido no documento %s: %s", i, score)
                         score = 0.0
                 
                 # Cria o objeto de resposta
@@ -86,16 +89,16 @@ def buscar_contratos(q: str, limit: int = 50):
                     score=score
                 ))
             except Exception as e:
-                print(f"Erro ao processar documento {i}: {e}")
+                logger.error("Erro ao processar documento %s: %s", i, e)
                 continue
         
         # Verifica se algum resultado foi processado com sucesso
         if not resultados:
-            print("Aviso: nenhum documento válido encontrado após processamento")
+            logger.warning("Nenhum documento válido encontrado após processamento")
             return SearchResponse(resultados=[], total=0)
         
         total = len(resultados)
-        print(f"Busca concluída com sucesso: {total} resultados válidos")
+        logger.info("Busca concluída com sucesso: %s resultados válidos", total)
         
         return SearchResponse(resultados=resultados, total=total)
     
@@ -103,5 +106,5 @@ def buscar_contratos(q: str, limit: int = 50):
         # Repassa exceções HTTP já formatadas
         raise
     except Exception as e:
-        print(f"Erro detalhado na busca de contratos: {e}")
+        logger.error("Erro detalhado na busca de contratos: %s", e)
         raise HTTPException(status_code=500, detail=f"Erro ao realizar a busca: {str(e)}")